@@ -1,74 +1,243 @@
 #!/usr/bin/env python
 
 import argparse
+import functools
 import importlib.metadata
+import io
+import os
+import pathlib
 import re
 import shutil
 import subprocess
 import sys
-import tempfile
 from typing import IO
-from typing import Iterator
 
-import yaml
+CONFIG_FILE = ".pre-commit-config.yaml"
+REPO_RE = re.compile(r"^\s*(-\s+)?repo:")
+MYPY_REPO_RE = re.compile(
+    r"^\s*(-\s+)?repo:\s*[\"']?https://github.com/pre-commit/mirrors-mypy[\"']?"
+    r"\s*(#.*)?$"
+)
+DEPS_RE = re.compile(r"^\s*(-\s+)?additional_dependencies:")
+BLOCK_DEPS_RE = re.compile(r"^\s*(-\s+)?additional_dependencies:\s*(#.*)?$")
+FLOW_DEPS_RE = re.compile(
+    r"^(\s*(?:-\s+)?additional_dependencies:\s*)"
+    r"\[((?:\"[^\"]*\"|'[^']*'|[^]\"'])*)\](\s*#.*?)?\s*$"
+)
+# a block-style list item: quoted or bare value, optionally followed by a comment
+ITEM_RE = re.compile(r"""^(\s*)-\s*(?:"([^"]*)"|'([^']*)'|(.*?))(\s+#.*?)?\s*$""")
+# an item of a single-line `[...]` list
+FLOW_ITEM_RE = re.compile(r"""\s*("[^"]*"|'[^']*'|[^,\s][^,]*)""")
+REQ_RE = re.compile(r"^(\S+)\s*==\s*(\S+)$")
+NAME_SEP_RE = re.compile(r"[-_.]+")
 
 
 class UpdateDependencies:
-    def __init__(self, fn: str, new_deps: list[str]):
+    def __init__(self, fn: str):
         self.fn = fn
-        self.new_deps = new_deps
-        self.state = "pre"
-        self.indent = ""
+        with open(fn) as fp:
+            self.lines = fp.read().splitlines(keepends=True)
 
-    def handle(self, line: str) -> Iterator[str]:
-        match self.state:
-            case "pre":
-                yield line
-                if line.strip() == "additional_dependencies:":
-                    self.state = "in-deps"
-                    self.indent = " " * sum(1 for c in line.rstrip() if c == " ")
+        self.start = self._find_deps()
+        # (line index, indent, dependency, trailing comment) for each list item
+        self.items: list[tuple[int, str, str, str]] = []
+        # raw items of a single-line `additional_dependencies: [...]` list
+        self.flow_items: list[str] = []
 
-            case "in-deps":
-                for dep in self.new_deps:
-                    yield f'{self.indent}  - "{dep}"\n'
+        line = self.lines[self.start]
+        self.flow = FLOW_DEPS_RE.match(line)
+        if self.flow:
+            self.flow_items = [
+                item.strip() for item in FLOW_ITEM_RE.findall(self.flow.group(2))
+            ]
+            self.dependencies = [_unquote(item) for item in self.flow_items]
+        elif BLOCK_DEPS_RE.match(line):
+            self._parse_block()
+            self.dependencies = [dep for _, _, dep, _ in self.items]
+        else:
+            print(f"unsupported additional_dependencies format in {fn}, skipping")
+            self.dependencies = []
+
+    def _parse_block(self) -> None:
+        line = self.lines[self.start]
+        indent = line[: len(line) - len(line.lstrip())]
+        for k in range(self.start + 1, len(self.lines)):
+            line = self.lines[k]
+            stripped = line.strip()
+            if stripped == "" or stripped.startswith("#"):
+                # blank and comment lines don't end the list
+                continue
+            if not (line.startswith(indent) and stripped.startswith("-")):
+                break
+            if m := ITEM_RE.match(line):
+                dep = next(g for g in m.group(2, 3, 4) if g is not None)
+                self.items.append((k, m.group(1), dep, m.group(5) or ""))
+
+    def _find_deps(self) -> int:
+        in_mypy = False
+        for k, line in enumerate(self.lines):
+            if REPO_RE.match(line):
+                in_mypy = MYPY_REPO_RE.match(line) is not None
+            elif in_mypy and DEPS_RE.match(line):
+                return k
+
+        raise ValueError(
+            f"no additional_dependencies found for mirrors-mypy in {self.fn}"
+        )
+
+    def render(self, new_deps: list[str]) -> list[str]:
+        lines = self.lines[:]
+        for (k, indent, dep, comment), new_dep in zip(self.items, new_deps):
+            # leave untouched entries exactly as written
+            if new_dep != dep:
+                lines[k] = f'{indent}- "{new_dep}"{comment}\n'
+
+        if self.flow and new_deps != self.dependencies:
+            items = [
+                item if new_dep == dep else f'"{new_dep}"'
+                for item, dep, new_dep in zip(
+                    self.flow_items, self.dependencies, new_deps
+                )
+            ]
+            prefix, comment = self.flow.group(1), self.flow.group(3) or ""
+            lines[self.start] = f"{prefix}[{', '.join(items)}]{comment}\n"
+
+        return lines
+
+
+def _unquote(item: str) -> str:
+    if len(item) >= 2 and item[0] == item[-1] and item[0] in "\"'":
+        return item[1:-1]
+
+    return item
+
+
+@functools.cache
+def _dep_name(spec: str) -> str:
+    return spec.split("=", 1)[0]
+
+
+@functools.cache
+def _canonical_name(name: str) -> str:
+    # PEP 503 normalization, so `Flask_SQLAlchemy` matches `flask-sqlalchemy`
+    return NAME_SEP_RE.sub("-", name).lower()
+
+
+@functools.cache
+def _dist_info_versions() -> dict[str, str | None]:
+    # `{name}-{version}.dist-info` directory names carry everything we need,
+    # so there is no need to read each package's METADATA file. `.egg-info`
+    # names don't reliably include a version, so they map to None, which
+    # hands the lookup to importlib.metadata while still shadowing any later
+    # `.dist-info`. Distributions importlib.metadata finds by other means
+    # (zipped sys.path entries, custom finders) aren't seen here and don't
+    # shadow anything; names missing from this map fall back to it as well.
+    versions: dict[str, str | None] = {}
+    for path in sys.path:
+        try:
+            entries = list(os.scandir(path or "."))
+        except OSError:
+            continue
+
+        for entry in entries:
+            stem, ext = os.path.splitext(entry.name)
+            if ext not in (".dist-info", ".egg-info"):
+                continue
+
+            name, _, version = stem.partition("-")
+            # earlier sys.path entries take precedence, as for imports
+            versions.setdefault(
+                _canonical_name(name), version if ext == ".dist-info" else None
+            )
+
+    return versions
 
-                self.state = "skip-old-deps"
 
-            case "skip-old-deps":
-                if not line.startswith(f"{self.indent}  -"):
-                    yield line
-                    self.state = "post"
+@functools.cache
+def _installed_version(name: str) -> str | None:
+    if version := _dist_info_versions().get(name):
+        return version
 
-            case "post":
-                yield line
+    # an .egg-info install or not in a sys.path directory, read its metadata
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
 
-    def __iter__(self) -> Iterator[str]:
-        with open(self.fn) as fp:
-            for line in fp:
-                yield from self.handle(line)
 
+def _satisfied(spec: str) -> bool:
+    m = REQ_RE.match(spec)
+    if m is None:
+        return False
 
-def do(outfp: IO[str], package_versions: dict[str, str]) -> None:
-    with open(".pre-commit-config.yaml") as fp:
-        cfg = yaml.safe_load(fp)
+    name, version = m.group(1, 2)
+    return _installed_version(_canonical_name(name)) == version
 
-    mypy = [
-        tool
-        for tool in cfg["repos"]
-        if tool["repo"] == "https://github.com/pre-commit/mirrors-mypy"
-    ][0]
-    dependencies = mypy["hooks"][0]["additional_dependencies"]
+
+def parse_requirements(fn: str) -> list[tuple[str, str]]:
+    pins = []
+    with open(fn) as fp:
+        lines = fp.read().splitlines()
+
+    for line in lines:
+        line = line.strip()
+        if line.startswith("#") or line == "":
+            continue
+
+        if m := REQ_RE.match(line):
+            pins.append(m.group(1, 2))
+        else:
+            raise ValueError(f"unable to parse requirement: {line}")
+
+    return pins
+
+
+def _all_satisfied(requirements: list[str] | None, specs: list[str] | None) -> bool:
+    # skipping pip is only safe if every requirement is a pin that's already
+    # installed; otherwise pip must see the full set to resolve it jointly
+    specs = list(specs or [])
+    for req in requirements or []:
+        try:
+            specs.extend(
+                f"{name}=={version}" for name, version in parse_requirements(req)
+            )
+        except ValueError:
+            # not just `name==version` pins, which we can't check
+            return False
+
+    return all(_satisfied(spec) for spec in specs)
+
+
+def installed_versions(names: list[str]) -> dict[str, str]:
+    package_versions = {}
+    for name in map(_canonical_name, names):
+        if (version := _installed_version(name)) is not None:
+            package_versions[name] = version
+
+    return package_versions
+
+
+def do(
+    outfp: IO[str],
+    update: UpdateDependencies,
+    package_versions: dict[str, str] | None = None,
+) -> None:
+    dependencies = update.dependencies
+
+    if package_versions is None:
+        # look up only the packages named in the config
+        package_versions = installed_versions([_dep_name(dep) for dep in dependencies])
 
     new_deps = []
     for dep in dependencies:
-        name = dep.split("=", 1)[0]
-        if name in package_versions:
-            new_deps.append(f"{name}=={package_versions[name]}")
+        name = _dep_name(dep)
+        if (key := _canonical_name(name)) in package_versions:
+            new_deps.append(f"{name}=={package_versions[key]}")
         else:
             print(f"{name} not currently installed, skipping")
             new_deps.append(dep)
 
-    outfp.writelines(UpdateDependencies(".pre-commit-config.yaml", new_deps))
+    outfp.write("".join(update.render(new_deps)))
 
 
 def main() -> None:
@@ -102,6 +271,11 @@ def main() -> None:
 
     opts = argparser.parse_args()
 
+    # find the mypy dependencies up front, so a broken config fails before pip runs
+    update = UpdateDependencies(CONFIG_FILE)
+
+    package_versions: dict[str, str] | None
+
     if not opts.no_install:
         pip_args = []
         for req in opts.requirements or []:
@@ -110,42 +284,51 @@ def main() -> None:
         for req in opts.pip_install or []:
             pip_args.append(req)
 
-        if pip_args:
-            args = [sys.executable, "-m", "pip", "install"] + pip_args
-            subprocess.check_call(args)
+        if pip_args and not _all_satisfied(opts.requirements, opts.pip_install):
+            args = [
+                sys.executable,
+                "-m",
+                "pip",
+                "install",
+                "--disable-pip-version-check",
+                "--no-input",
+                "--no-color",
+                "-q",
+            ] + pip_args
+            subprocess.run(args, check=True)
+            _dist_info_versions.cache_clear()
+            _installed_version.cache_clear()
 
-        package_versions = {
-            dist.metadata["Name"]: dist.version
-            for dist in importlib.metadata.distributions()
-        }
+        package_versions = None
 
     elif opts.requirements:
         package_versions = {}
         for req in opts.requirements:
-            for line in open(req):
-                line = line.strip()
-                if line.startswith("#") or line == "":
-                    continue
-
-                if m := re.match(r"^(\S+)\s*==\s*(\S+)$", line):
-                    package_versions[m.group(1)] = m.group(2)
-                else:
-                    raise ValueError(f"unable to parse requirement: {line}")
+            for name, version in parse_requirements(req):
+                package_versions[_canonical_name(name)] = version
 
     else:
         # use the current installed packages
-        package_versions = {
-            dist.metadata["Name"]: dist.version
-            for dist in importlib.metadata.distributions()
-        }
+        package_versions = None
 
     if opts.in_place:
-        with tempfile.NamedTemporaryFile(mode="w") as ofp:
-            do(ofp, package_versions)
-            ofp.flush()
-            shutil.copy(ofp.file.name, ".pre-commit-config.yaml")
+        buf = io.StringIO()
+        do(buf, update, package_versions)
+
+        # follow a symlinked config so the link itself is left in place
+        config = pathlib.Path(CONFIG_FILE).resolve()
+        if buf.getvalue() != "".join(update.lines):
+            # write next to the config so the final rename is atomic
+            tmp = config.with_name(f"{config.name}.tmp")
+            try:
+                tmp.write_text(buf.getvalue())
+                shutil.copymode(config, tmp)
+                os.replace(tmp, config)
+            except BaseException:
+                tmp.unlink(missing_ok=True)
+                raise
     else:
-        do(sys.stdout, package_versions)
+        do(sys.stdout, update, package_versions)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,258 @@
+import io
+import os
+import sys
+import textwrap
+
+import pytest
+
+from hooks import mypy_sync
+from hooks.mypy_sync import UpdateDependencies
+from hooks.mypy_sync import do
+
+CONFIG = """\
+repos:
+  - repo: https://github.com/pre-commit/mirrors-mypy
+    hooks:
+      - id: mypy
+        additional_dependencies:
+          - "a==0.1"
+"""
+
+
+def sync(tmp_path, config: str, package_versions: dict[str, str]) -> str:
+    fn = tmp_path / ".pre-commit-config.yaml"
+    fn.write_text(textwrap.dedent(config))
+    buf = io.StringIO()
+    do(buf, UpdateDependencies(str(fn)), package_versions)
+    return buf.getvalue()
+
+
+def test_only_mypy_repo_is_updated(tmp_path):
+    config = """\
+        repos:
+          - repo: https://github.com/psf/black
+            hooks:
+              - id: black
+                additional_dependencies:
+                  - "pyyaml==1.0"
+          - repo: https://github.com/pre-commit/mirrors-mypy
+            hooks:
+              - id: mypy
+                additional_dependencies:
+                  - "PyYAML==1.0"
+                args: [--strict]
+        """
+    assert sync(tmp_path, config, {"pyyaml": "6.0"}) == textwrap.dedent(config).replace(
+        '- "PyYAML==1.0"', '- "PyYAML==6.0"'
+    )
+
+
+def test_item_styles_and_comments(tmp_path):
+    config = """\
+        repos:
+        - repo: https://github.com/pre-commit/mirrors-mypy  # types
+          hooks:
+          - id: mypy
+            additional_dependencies:
+            # stubs
+            - missingpkg==1.0  # keep
+            - "missing2==1.0"  # keep
+
+            - 'types-requests==0.1'  # http
+            - PyYAML
+        """
+    expected = """\
+        repos:
+        - repo: https://github.com/pre-commit/mirrors-mypy  # types
+          hooks:
+          - id: mypy
+            additional_dependencies:
+            # stubs
+            - missingpkg==1.0  # keep
+            - "missing2==1.0"  # keep
+
+            - "types-requests==2.31"  # http
+            - "PyYAML==6.0"
+        """
+    versions = {"pyyaml": "6.0", "types-requests": "2.31"}
+    assert sync(tmp_path, config, versions) == textwrap.dedent(expected)
+
+
+def test_flow_style_list(tmp_path):
+    config = """\
+        repos:
+          - repo: https://github.com/pre-commit/mirrors-mypy
+            hooks:
+              - id: mypy
+                additional_dependencies: [missing==1, "types-requests==0.1"]  # x
+        """
+    assert sync(tmp_path, config, {"types-requests": "2.31"}) == textwrap.dedent(
+        config
+    ).replace('"types-requests==0.1"', '"types-requests==2.31"')
+
+
+def test_unchanged_config_is_identical(tmp_path):
+    config = """\
+        repos:
+          - repo: https://github.com/pre-commit/mirrors-mypy
+            hooks:
+              - id: mypy
+                additional_dependencies:
+                  - PyYAML==6.0  # already current
+        """
+    assert sync(tmp_path, config, {"pyyaml": "6.0"}) == textwrap.dedent(config)
+
+
+def test_missing_mypy_repo(tmp_path):
+    config = """\
+        repos:
+          - repo: https://github.com/psf/black
+            hooks:
+              - id: black
+                additional_dependencies:
+                  - click
+        """
+    with pytest.raises(ValueError, match="no additional_dependencies"):
+        sync(tmp_path, config, {})
+
+
+class FakeLookup:
+    # stands in for the cached version lookups, recording cache_clear() calls
+    def __init__(self, versions: dict[str, str]):
+        self.versions = versions
+        self.cleared = 0
+
+    def __call__(self, name: str) -> str | None:
+        return self.versions.get(name)
+
+    def cache_clear(self) -> None:
+        self.cleared += 1
+
+
+@pytest.fixture
+def pip(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / ".pre-commit-config.yaml").write_text(CONFIG)
+    (tmp_path / "req.txt").write_text("# pins\na==1.0\n")
+
+    calls = []
+    monkeypatch.setattr(
+        mypy_sync.subprocess, "run", lambda args, **kwargs: calls.append(args)
+    )
+    monkeypatch.setattr(mypy_sync, "_dist_info_versions", FakeLookup({}))
+    monkeypatch.setattr(
+        mypy_sync, "_installed_version", FakeLookup({"a": "1.0", "b": "2.0"})
+    )
+    return calls
+
+
+def run_main(monkeypatch, *args: str) -> None:
+    monkeypatch.setattr(sys, "argv", ["mypy-sync", *args])
+    mypy_sync.main()
+
+
+def test_pip_skipped_when_satisfied(pip, monkeypatch):
+    run_main(monkeypatch, "-r", "req.txt", "-p", "b==2.0")
+    assert pip == []
+
+
+def test_pip_gets_full_arguments_when_unsatisfied(pip, monkeypatch):
+    run_main(monkeypatch, "-r", "req.txt", "-p", "b==2.0", "-p", "c==3.0")
+    assert len(pip) == 1
+    assert pip[0][-4:] == ["-r", "req.txt", "b==2.0", "c==3.0"]
+    assert mypy_sync._installed_version.cleared == 1
+    assert mypy_sync._dist_info_versions.cleared == 1
+
+
+@pytest.mark.parametrize("line", ["-e .", "foo>=1", 'a==1.0; python_version >= "3"'])
+def test_pip_gets_unpinned_file_whole(pip, monkeypatch, tmp_path, line):
+    (tmp_path / "req.txt").write_text(f"a==1.0\n{line}\n")
+    run_main(monkeypatch, "-r", "req.txt")
+    assert len(pip) == 1
+    assert pip[0][-2:] == ["-r", "req.txt"]
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    # an isolated sys.path, with the version lookup caches reset around it
+    paths = [tmp_path / "first", tmp_path / "second"]
+    for path in paths:
+        path.mkdir()
+    monkeypatch.setattr(sys, "path", [str(path) for path in paths])
+    mypy_sync._dist_info_versions.cache_clear()
+    mypy_sync._installed_version.cache_clear()
+    yield paths
+    mypy_sync._dist_info_versions.cache_clear()
+    mypy_sync._installed_version.cache_clear()
+
+
+def test_version_from_dist_info_name(site):
+    (site[0] / "Foo_Bar-1.2.dist-info").mkdir()
+    assert mypy_sync._installed_version("foo-bar") == "1.2"
+    assert mypy_sync._installed_version("missing") is None
+
+
+def test_earlier_egg_info_shadows_dist_info(site):
+    egg_info = site[0] / "Foo_Bar-1.0-py3.12.egg-info"
+    egg_info.mkdir()
+    (egg_info / "PKG-INFO").write_text(
+        "Metadata-Version: 2.1\nName: Foo_Bar\nVersion: 1.0\n"
+    )
+    (site[1] / "Foo_Bar-1.2.dist-info").mkdir()
+    assert mypy_sync._installed_version("foo-bar") == "1.0"
+
+
+@pytest.fixture
+def in_place(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "req.txt").write_text("a==1.0\n")
+    return tmp_path
+
+
+def in_place_leftovers(path) -> list[str]:
+    return [p.name for p in path.rglob("*.tmp")]
+
+
+def test_in_place_rewrites_and_keeps_mode(in_place, monkeypatch):
+    config = in_place / ".pre-commit-config.yaml"
+    config.write_text(CONFIG)
+    config.chmod(0o640)
+    run_main(monkeypatch, "-i", "-N", "-r", "req.txt")
+    assert config.read_text() == CONFIG.replace('"a==0.1"', '"a==1.0"')
+    assert config.stat().st_mode & 0o777 == 0o640
+    assert in_place_leftovers(in_place) == []
+
+
+def test_in_place_leaves_unchanged_config_alone(in_place, monkeypatch):
+    config = in_place / ".pre-commit-config.yaml"
+    config.write_text(CONFIG.replace('"a==0.1"', '"a==1.0"'))
+    os.utime(config, ns=(1_000_000_000, 1_000_000_000))
+    run_main(monkeypatch, "-i", "-N", "-r", "req.txt")
+    assert config.stat().st_mtime_ns == 1_000_000_000
+    assert in_place_leftovers(in_place) == []
+
+
+def test_in_place_follows_symlink(in_place, monkeypatch):
+    (in_place / "real").mkdir()
+    target = in_place / "real" / "config.yaml"
+    target.write_text(CONFIG)
+    config = in_place / ".pre-commit-config.yaml"
+    config.symlink_to(target)
+    run_main(monkeypatch, "-i", "-N", "-r", "req.txt")
+    assert config.is_symlink()
+    assert target.read_text() == CONFIG.replace('"a==0.1"', '"a==1.0"')
+    assert in_place_leftovers(in_place) == []
+
+
+def test_in_place_removes_temp_file_on_failure(in_place, monkeypatch):
+    config = in_place / ".pre-commit-config.yaml"
+    config.write_text(CONFIG)
+
+    def copymode(src, dst):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(mypy_sync.shutil, "copymode", copymode)
+    with pytest.raises(OSError):
+        run_main(monkeypatch, "-i", "-N", "-r", "req.txt")
+    assert config.read_text() == CONFIG
+    assert in_place_leftovers(in_place) == []